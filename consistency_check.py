@@ -0,0 +1,195 @@
+import contextlib
+import os
+import random
+import shutil
+import stat
+import tempfile
+from typing import Any, Dict, List, Tuple
+from csv_warehouse import NaiveCSVWarehouse
+from my_data_warehouse import MyDataWarehouse
+
+
+def normalize(rows: List[Dict[str, Any]]) -> List[Tuple[Tuple[str, Any], ...]]:
+    """
+    Put query results in a canonical order, since partitions return rows in a different order.
+
+    Args:
+        rows (List[Dict[str, Any]]): Query results.
+
+    Returns:
+        List[Tuple[Tuple[str, Any], ...]]: The rows as sorted tuples of items.
+    """
+    return sorted(tuple(sorted(row.items())) for row in rows)
+
+
+def check_random_workload(seed: int, storage_layout: str, use_session: bool) -> None:
+    """
+    Run the same random mix of operations against MyDataWarehouse and
+    NaiveCSVWarehouse and check that every query returns the same rows,
+    both while running and after reopening the partitions from disk.
+
+    Args:
+        seed (int): Seed for the random operations.
+        storage_layout (str): Storage layout of the MyDataWarehouse under test.
+        use_session (bool): Whether to run the workload inside an ingest session.
+    """
+    rnd = random.Random(seed)
+    storage_dir = tempfile.mkdtemp()
+    try:
+        naive_warehouse = NaiveCSVWarehouse(os.path.join(storage_dir, "naive_warehouse.csv"))
+        my_warehouse = MyDataWarehouse(partition_size=rnd.choice([500, 1000, 5000]),
+                                       storage_dir=os.path.join(storage_dir, "my_partitions"),
+                                       storage_layout=storage_layout)
+        # Small buffers exercise flushes in the middle of the workload, and a
+        # small row cache sends updates and deletes through the stream edit
+        my_warehouse._buffer_threshold = rnd.choice([1, 3, 1024])
+        my_warehouse._row_cache_limit = rnd.choice([1, 16])
+
+        def compare(key_column: str, keys: List[str]) -> None:
+            expected = normalize(naive_warehouse.query_data(key_column, keys))
+            actual = normalize(my_warehouse.query_data(key_column, keys))
+            assert actual == expected, f"seed {seed}: query_data({key_column!r}, {keys}) differs"
+
+        with (my_warehouse.ingest_session() if use_session else contextlib.nullcontext()):
+            rows = [{"id": str(i), "name": f"name-{i % 37}", "city": f"city-{i % 5}"} for i in range(1, 400)]
+            for warehouse in (naive_warehouse, my_warehouse):
+                warehouse.add_data_bulk(rows[:200])
+                for row in rows[200:]:
+                    warehouse.add_data(row)
+
+            for step in range(300):
+                operation = rnd.random()
+                key_column = rnd.choice(["id", "id", "name", "city"])
+                if key_column == "id":
+                    key_value = str(rnd.randint(1, 500))
+                elif key_column == "name":
+                    key_value = f"name-{rnd.randint(0, 40)}"
+                else:
+                    key_value = f"city-{rnd.randint(0, 6)}"
+
+                if operation < 0.3:
+                    # Ids are unique, so "first match" is the same row in both warehouses
+                    key_value = str(rnd.randint(1, 500))
+                    for warehouse in (naive_warehouse, my_warehouse):
+                        warehouse.update_data("id", key_value, {"name": f"updated-{step}"})
+                elif operation < 0.4:
+                    for warehouse in (naive_warehouse, my_warehouse):
+                        warehouse.delete_data(key_column, key_value)
+                elif operation < 0.5:
+                    row = {"id": str(1000 + step), "name": f"name-{step % 37}", "city": "city-new"}
+                    for warehouse in (naive_warehouse, my_warehouse):
+                        warehouse.add_data(row)
+                else:
+                    compare(key_column, [key_value] + [str(rnd.randint(1, 500)) for _ in range(rnd.randint(0, 5))])
+
+        all_ids = [str(i) for i in range(1400)]
+        compare("id", all_ids)
+
+        my_warehouse.flush()
+        my_warehouse = MyDataWarehouse(partition_size=my_warehouse.partition_size,
+                                       storage_dir=my_warehouse.storage_dir,
+                                       storage_layout=storage_layout)
+        compare("id", all_ids)
+        compare("city", ["city-1", "city-new"])
+    finally:
+        shutil.rmtree(storage_dir)
+
+
+def check_update_adding_column(storage_layout: str, warm_cache: bool) -> None:
+    """
+    Check that an update introducing a new column keeps every row of the partition.
+
+    Args:
+        storage_layout (str): Storage layout of the MyDataWarehouse under test.
+        warm_cache (bool): Whether the partition is in the row cache when it is updated.
+    """
+    storage_dir = tempfile.mkdtemp()
+    try:
+        my_warehouse = MyDataWarehouse(partition_size=10_000, storage_dir=storage_dir,
+                                       storage_layout=storage_layout)
+        my_warehouse.add_data_bulk([{"id": str(i), "name": f"name-{i}"} for i in range(10)])
+        my_warehouse.flush()
+        if warm_cache:
+            my_warehouse.query_data("id", ["0"])
+
+        my_warehouse.update_data("id", "5", {"extra": "x"})
+
+        reopened = MyDataWarehouse(partition_size=10_000, storage_dir=storage_dir,
+                                   storage_layout=storage_layout)
+        # The updated instance must agree with what was written to disk
+        for warehouse in (my_warehouse, reopened):
+            rows = warehouse.query_data("id", [str(i) for i in range(10)])
+            assert len(rows) == 10, f"{storage_layout}: update adding a column lost rows"
+            assert [row["id"] for row in rows if row["extra"]] == ["5"]
+            assert len(warehouse.query_data("extra", [""])) == 9, \
+                f"{storage_layout}: rows without the new column do not match ''"
+    finally:
+        shutil.rmtree(storage_dir)
+
+
+def check_rejected_row_keeps_buffer(storage_layout: str) -> None:
+    """
+    Check that a row with fields outside the partition headers is rejected
+    when added, and that rows buffered before it are still written.
+
+    Args:
+        storage_layout (str): Storage layout of the MyDataWarehouse under test.
+    """
+    storage_dir = tempfile.mkdtemp()
+    try:
+        my_warehouse = MyDataWarehouse(partition_size=10_000, storage_dir=storage_dir,
+                                       storage_layout=storage_layout)
+        my_warehouse.add_data({"id": "1", "name": "a"})
+        try:
+            my_warehouse.add_data({"id": "2", "name": "b", "extra": "z"})
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{storage_layout}: row with an unknown field was accepted")
+        my_warehouse.add_data({"id": "3", "name": "c"})
+
+        expected = normalize([{"id": "1", "name": "a"}, {"id": "3", "name": "c"}])
+        assert normalize(my_warehouse.query_data("id", ["1", "2", "3"])) == expected
+    finally:
+        shutil.rmtree(storage_dir)
+
+
+def check_rewrite_keeps_file_mode() -> None:
+    """Check that updates and deletes leave the partition file's permissions unchanged."""
+    storage_dir = tempfile.mkdtemp()
+    try:
+        my_warehouse = MyDataWarehouse(partition_size=10_000, storage_dir=storage_dir)
+        my_warehouse.add_data_bulk([{"id": str(i), "name": f"name-{i}"} for i in range(10)])
+        my_warehouse.flush()
+        partition_path = my_warehouse._get_all_partition_files()[0]
+        os.chmod(partition_path, 0o644)
+
+        for row_cache_limit in (0, 16):
+            # 0 forces the stream edit, 16 the in-memory rewrite
+            my_warehouse._row_cache_limit = row_cache_limit
+            my_warehouse.update_data("id", "2", {"name": f"updated-{row_cache_limit}"})
+            my_warehouse.delete_data("id", str(row_cache_limit % 10))
+            assert stat.S_IMODE(os.stat(partition_path).st_mode) == 0o644, "partition file mode changed"
+    finally:
+        shutil.rmtree(storage_dir)
+
+
+def run_checks() -> None:
+    for storage_layout in ("row", "column"):
+        for use_session in (False, True):
+            print(f"Checking random workload (layout={storage_layout}, session={use_session})...")
+            for seed in range(10):
+                check_random_workload(seed, storage_layout, use_session)
+
+        print(f"Checking error paths (layout={storage_layout})...")
+        for warm_cache in (False, True):
+            check_update_adding_column(storage_layout, warm_cache)
+        check_rejected_row_keeps_buffer(storage_layout)
+
+    print("Checking file permissions after rewrites...")
+    check_rewrite_keeps_file_mode()
+    print("\nAll checks passed.")
+
+
+if __name__ == "__main__":
+    run_checks()
@@ -16,29 +16,30 @@ class NaiveCSVWarehouse(DataWarehouse):
         Args:
             data (Dict[str, Any]): A dictionary representing a row of data.
         """
-        file_exists = os.path.exists(self.csv_file)
+        self.add_data_bulk([data])
 
-        # If file doesn't exist, create it with headers
-        if not file_exists:
-            with open(self.csv_file, 'w', newline='', encoding='utf-8') as file:
-                if data:
-                    writer = csv.DictWriter(file, fieldnames=data.keys())
-                    writer.writeheader()
-                    writer.writerow(data)
-        else:
-            # Append data to existing file
-            with open(self.csv_file, 'a', newline='', encoding='utf-8') as file:
-                if data:
-                    # Read existing headers to maintain consistency
-                    existing_headers = self._get_headers()
-                    if existing_headers:
-                        writer = csv.DictWriter(file, fieldnames=existing_headers)
-                        writer.writerow(data)
-                    else:
-                        # File exists but is empty, write headers first
-                        writer = csv.DictWriter(file, fieldnames=data.keys())
-                        writer.writeheader()
-                        writer.writerow(data)
+    def add_data_bulk(self, rows: List[Dict[str, Any]]) -> None:
+        """
+        Add multiple rows of data to the CSV file with a single open/write.
+        
+        Args:
+            rows (List[Dict[str, Any]]): A list of dictionaries, each representing a row of data.
+        """
+        rows = [row for row in rows if row]
+        if not rows:
+            return
+
+        # Read existing headers to maintain consistency
+        existing_headers = self._get_headers()
+
+        with open(self.csv_file, 'a', newline='', encoding='utf-8') as file:
+            if existing_headers:
+                writer = csv.DictWriter(file, fieldnames=existing_headers)
+            else:
+                # File is missing or empty, write headers first
+                writer = csv.DictWriter(file, fieldnames=rows[0].keys())
+                writer.writeheader()
+            writer.writerows(rows)
 
     def _get_headers(self) -> List[str]:
         """Get the headers from the CSV file."""
@@ -89,10 +90,11 @@ class NaiveCSVWarehouse(DataWarehouse):
             updated_data (Dict[str, Any]): A dictionary with updated column values.
         """
         all_data = self._read_all_data()
+        str_key_value = str(key_value)
         updated = False
 
         for row in all_data:
-            if row.get(key_column) == str(key_value):
+            if row.get(key_column) == str_key_value:
                 row.update(updated_data)
                 updated = True
                 break  # Update only the first matching row
@@ -109,7 +111,8 @@ class NaiveCSVWarehouse(DataWarehouse):
             key_value (Any): The value to match in the key column.
         """
         all_data = self._read_all_data()
-        filtered_data = [row for row in all_data if row.get(key_column) != str(key_value)]
+        str_key_value = str(key_value)
+        filtered_data = [row for row in all_data if row.get(key_column) != str_key_value]
 
         # Only rewrite if data was actually deleted
         if len(filtered_data) != len(all_data):
@@ -130,11 +133,6 @@ class NaiveCSVWarehouse(DataWarehouse):
             return []
 
         all_data = self._read_all_data()
-        str_keys = [str(key) for key in keys]
-
-        results = []
-        for row in all_data:
-            if row.get(key_column) in str_keys:
-                results.append(row)
+        str_keys = frozenset(str(key) for key in keys)  # O(1) membership per row
 
-        return results
+        return [row for row in all_data if row.get(key_column) in str_keys]
@@ -1,7 +1,18 @@
+import atexit
+import contextlib
 import csv
+import io
+import json
+import mmap
 import os
-import hashlib
-from typing import Any, List, Dict, Optional, Set
+import shutil
+import tempfile
+import threading
+import weakref
+import zlib
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, Callable, ContextManager, Iterator, List, Dict, Optional, Set, Tuple
 from data_warehouse import DataWarehouse
 
 
@@ -13,30 +24,115 @@ class MyDataWarehouse(DataWarehouse):
     Design decisions:
     - Hash-based partitioning using the 'id' field for even distribution
     - Each partition stored as a separate CSV file (partition_0.csv, partition_1.csv, etc.)
+    - Optional column layout: each partition is a directory (partition_0/, ...) with
+      one file per column, so key scans read only the key column's file
     - Partition size controls the target number of rows per partition
     - Directory-based storage organization for better file management
+    - Appends are buffered per partition and written in batches; reads, updates
+      and deletes flush pending rows first, and flush() persists them explicitly
     """
     
-    def __init__(self, partition_size: int, storage_dir: str):
-        """Initialize the partitioned warehouse with partition size and storage directory."""
+    def __init__(self, partition_size: int, storage_dir: str, use_fast_scan: bool = True,
+                 storage_layout: str = 'row'):
+        """
+        Initialize the partitioned warehouse with partition size and storage directory.
+        
+        Args:
+            partition_size (int): Target number of rows per partition.
+            storage_dir (str): Directory holding the partition files.
+            use_fast_scan (bool): Scan key columns of quote-free partitions with
+                plain string splitting instead of the csv module.
+            storage_layout (str): 'row' stores each partition as one CSV file;
+                'column' stores each partition as a directory of per-column files.
+        """
+        if storage_layout not in ('row', 'column'):
+            raise ValueError(f"storage_layout must be 'row' or 'column', got {storage_layout!r}")
+        
         self.partition_size = partition_size
         self.storage_dir = storage_dir
+        self.use_fast_scan = use_fast_scan
+        self.storage_layout = storage_layout
+        self._partition_suffix = '.csv' if storage_layout == 'row' else ''
+        
+        # Number of hash partitions, fixed for the lifetime of the warehouse.
+        # Use partition_size to determine how many partitions we might need;
+        # for efficiency, keep a reasonable number of partitions (e.g., 10-20)
+        self._num_partitions = max(1, min(20, 10000 // partition_size))
+        
+        # Paths of the hash partitions, built once instead of per row
+        self._partition_paths = tuple(
+            os.path.join(self.storage_dir, f"partition_{partition_id}{self._partition_suffix}")
+            for partition_id in range(self._num_partitions)
+        )
         
         # Create storage directory if it doesn't exist
         if not os.path.exists(self.storage_dir):
             os.makedirs(self.storage_dir)
         
+        # Known partition files, discovered once and kept in sync on create/remove
+        with os.scandir(self.storage_dir) as entries:
+            self._known_partitions: Set[str] = {
+                entry.path for entry in entries
+                if (entry.is_file() if storage_layout == 'row' else entry.is_dir())
+                and self._partition_id_from_name(entry.name) is not None
+            }
+        
         # In-memory partition metadata cache for performance optimization
         self._partition_cache = {
-            'file_exists': {},      # Track which partition files exist
             'headers': {},          # Cache headers for each partition
             'row_counts': {},       # Track approximate row counts per partition
-            'last_accessed': {}     # Track last access time for cache management
+            'last_accessed': {},    # Track last access time for cache management
+            'column_index': {}      # Map column -> (mtime, value -> row positions) per partition
         }
+        
+        # LRU cache of parsed partition rows, validated against file mtimes
+        self._row_cache: 'OrderedDict[str, List[Dict[str, Any]]]' = OrderedDict()
+        self._mtime_cache: Dict[str, int] = {}
+        self._row_cache_limit = 16
+        self._row_cache_lock = threading.Lock()  # Query scans may run on worker threads
+        
+        # Largest key count for which a raw byte search of an unindexed partition
+        # is cheaper than parsing its key column
+        self._mmap_probe_max_keys = 4
+        
+        # Write-behind buffers of appended rows, flushed per partition in batches
+        self._write_buffers: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._buffer_threshold = 1024
+        # Registered through a weak reference so the warehouse can still be collected
+        atexit.register(MyDataWarehouse._flush_at_exit, weakref.ref(self))
+        
+        # Append-mode files held open across flushes while an ingest session is active
+        self._session_files: Dict[str, IO[str]] = {}
+        self._session_depth = 0
+    
+    def __del__(self) -> None:
+        """Flush rows still buffered when the warehouse is garbage collected."""
+        if getattr(self, '_write_buffers', None):
+            self._flush_pending()
+    
+    @staticmethod
+    def _flush_at_exit(warehouse_ref: 'weakref.ReferenceType[MyDataWarehouse]') -> None:
+        """Flush a warehouse at interpreter exit if it is still alive."""
+        warehouse = warehouse_ref()
+        if warehouse is not None:
+            warehouse._flush_pending()
+    
+    def _flush_pending(self) -> None:
+        """Flush buffered rows, unless the storage directory has since been removed."""
+        if os.path.isdir(self.storage_dir):
+            self.flush()
     
     def _get_partition_path(self, partition_id: int) -> str:
-        """Get the file path for a specific partition."""
-        return os.path.join(self.storage_dir, f"partition_{partition_id}.csv")
+        """Get the file (or, in column layout, directory) path for a specific partition."""
+        return self._partition_paths[partition_id]
+    
+    def _partition_id_from_name(self, name: str) -> Optional[int]:
+        """Extract the partition ID from a partition file name, or None if it is not one."""
+        if not (name.startswith('partition_') and name.endswith(self._partition_suffix)):
+            return None
+        partition_id = name[len('partition_'):len(name) - len(self._partition_suffix)]
+        # isdigit() alone also accepts characters such as '²' that int() rejects
+        return int(partition_id) if partition_id.isascii() and partition_id.isdigit() else None
     
     def _update_partition_cache(self, partition_path: str, headers: Optional[List[str]] = None, 
                                exists: Optional[bool] = None, row_count_delta: int = 0) -> None:
@@ -47,7 +143,10 @@ class MyDataWarehouse(DataWarehouse):
             self._partition_cache['headers'][partition_path] = headers
         
         if exists is not None:
-            self._partition_cache['file_exists'][partition_path] = exists
+            if exists:
+                self._known_partitions.add(partition_path)
+            else:
+                self._known_partitions.discard(partition_path)
         
         if row_count_delta != 0:
             current_count = self._partition_cache['row_counts'].get(partition_path, 0)
@@ -62,133 +161,577 @@ class MyDataWarehouse(DataWarehouse):
         if cached_headers is not None:
             return cached_headers
         
-        # If not cached and file exists, read just the first line to get headers
-        if os.path.exists(partition_path):
+        # If not cached and file exists, read just the headers
+        if self._partition_exists_cached(partition_path):
             try:
-                with open(partition_path, 'r', newline='', encoding='utf-8') as file:
-                    reader = csv.reader(file)
-                    headers = next(reader, [])
-                    if headers:
-                        self._update_partition_cache(partition_path, headers=headers, exists=True)
-                        return headers
-            except (IOError, csv.Error, StopIteration):
+                headers = self._read_stored_headers(partition_path)
+                if headers:
+                    self._update_partition_cache(partition_path, headers=headers, exists=True)
+                    return headers
+            except (IOError, csv.Error, ValueError):
                 pass
         
         return None
     
     def _partition_exists_cached(self, partition_path: str) -> bool:
-        """Check if a partition exists using cache when possible."""
-        # Check cache first
-        cached_exists = self._partition_cache['file_exists'].get(partition_path)
-        if cached_exists is not None:
-            return cached_exists
-        
-        # Check filesystem and update cache
-        exists = os.path.exists(partition_path)
-        self._update_partition_cache(partition_path, exists=exists)
-        return exists
+        """Check if a partition exists using the known partition set."""
+        return partition_path in self._known_partitions
     
     def _hash_to_partition(self, value: str) -> int:
         """Hash a value to determine its partition ID."""
-        # Use MD5 hash for consistent distribution
-        hash_obj = hashlib.md5(str(value).encode())
-        hash_int = int(hash_obj.hexdigest(), 16)
+        # CRC32 is deterministic across processes and far cheaper than a
+        # cryptographic hash; only the modulo of the result is used
+        return zlib.crc32(str(value).encode()) % self._num_partitions
+    
+    def _get_all_partition_files(self) -> List[str]:
+        """Get all existing partition files from the known partition set, ordered by partition ID."""
+        return sorted(self._known_partitions,
+                      key=lambda path: self._partition_id_from_name(os.path.basename(path)))
+    
+    def _partition_mtime(self, partition_path: str) -> Optional[int]:
+        """
+        Get the modification time of a partition, or None if it does not exist.
+        In column layout the schema file is touched on every write and versions the partition.
+        """
+        if self.storage_layout == 'column':
+            partition_path = os.path.join(partition_path, 'columns.json')
+        try:
+            return os.stat(partition_path).st_mtime_ns
+        except OSError:
+            return None
+    
+    @staticmethod
+    def _check_fields(headers: List[str], rows: List[Dict[str, Any]]) -> None:
+        """Raise ValueError, as csv.DictWriter would, if any row has fields not in headers."""
+        header_set = set(headers)
+        for row in rows:
+            if not row.keys() <= header_set:
+                extra_fields = [key for key in row if key not in header_set]
+                raise ValueError(f"dict contains fields not in fieldnames: {extra_fields}")
+    
+    @staticmethod
+    def _column_values(headers: List[str], rows: List[Dict[str, Any]]) -> List[List[str]]:
+        """Split rows into per-column value lists, formatting values as csv.DictWriter would."""
+        MyDataWarehouse._check_fields(headers, rows)
+        return [['' if row.get(column) is None else str(row.get(column)) for row in rows]
+                for column in headers]
+    
+    def _read_stored_headers(self, partition_path: str) -> List[str]:
+        """Read a partition's headers from storage without loading its rows."""
+        if self.storage_layout == 'column':
+            with open(os.path.join(partition_path, 'columns.json'), 'r', encoding='utf-8') as file:
+                return json.load(file)
         
-        # Calculate optimal number of partitions based on expected data size
-        # Use partition_size to determine how many partitions we might need
-        # For efficiency, use a reasonable number of partitions (e.g., 10-20)
-        optimal_partitions = max(1, min(20, 10000 // self.partition_size))
+        with open(partition_path, 'r', newline='', encoding='utf-8') as file:
+            header_line = file.readline()
+        return next(csv.reader([header_line]), [])
+    
+    def _read_stored_column(self, partition_path: str, column_idx: int) -> List[str]:
+        """Read one column file of a column-layout partition; each line is a JSON array batch."""
+        values: List[str] = []
+        with open(os.path.join(partition_path, f'col_{column_idx}.jsonl'), 'r', encoding='utf-8') as file:
+            for line in file:
+                values.extend(json.loads(line))
+        return values
+    
+    def _read_stored_rows(self, partition_path: str) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """Read a partition's headers and all of its rows from storage."""
+        if self.storage_layout == 'column':
+            headers = self._read_stored_headers(partition_path)
+            columns = [self._read_stored_column(partition_path, column_idx) for column_idx in range(len(headers))]
+            return headers, [dict(zip(headers, values)) for values in zip(*columns)]
         
-        return hash_int % optimal_partitions
+        with open(partition_path, 'r', newline='', encoding='utf-8') as file:
+            reader = csv.reader(file)
+            headers = next(reader, [])
+            header_count = len(headers)
+            # Skip blank lines and build dicts with zip, as csv.DictReader would,
+            # without its per-row Python overhead
+            data = [dict(zip(headers, row)) if len(row) == header_count else self._ragged_row_to_dict(headers, row)
+                    for row in reader if row]
+        return headers, data
     
-    def _get_all_partition_files(self) -> List[str]:
-        """Get all existing partition files using cached existence checks."""
-        partition_files = []
-        # Check all possible partitions since they may not be sequential
-        # Use the same range as the partition calculation
-        optimal_partitions = max(1, min(20, 10000 // self.partition_size))
-        for i in range(optimal_partitions):
-            partition_path = self._get_partition_path(i)
-            if self._partition_exists_cached(partition_path):
-                partition_files.append(partition_path)
-        return partition_files
+    def _open_for_append(self, file_path: str, **open_kwargs: Any) -> ContextManager[IO[str]]:
+        """Open a file for appending, reusing the ingest session's handle when one is active."""
+        if not self._session_depth:
+            return open(file_path, 'a', **open_kwargs)
+        
+        file = self._session_files.get(file_path)
+        if file is None:
+            file = self._session_files[file_path] = open(file_path, 'a', **open_kwargs)
+        return contextlib.nullcontext(file)
     
-    def _read_partition_data(self, partition_path: str) -> List[Dict[str, Any]]:
-        """Read all data from a partition file."""
-        if not os.path.exists(partition_path):
+    def _close_session_files(self, partition_path: str) -> None:
+        """Close session handles into a partition before its files are replaced or removed."""
+        for file_path in list(self._session_files):
+            if file_path == partition_path or file_path.startswith(partition_path + os.sep):
+                self._session_files.pop(file_path).close()
+    
+    @staticmethod
+    def _ragged_row_to_dict(headers: List[str], row: List[str]) -> Dict[Any, Any]:
+        """Build a dict for a row whose length differs from the headers, matching csv.DictReader."""
+        row_dict: Dict[Any, Any] = dict(zip(headers, row))
+        if len(row) > len(headers):
+            row_dict[None] = row[len(headers):]
+        else:
+            for column in headers[len(row):]:
+                row_dict[column] = None
+        return row_dict
+    
+    def _write_stored_rows(self, partition_path: str, headers: List[str],
+                           rows: List[Dict[str, Any]], append: bool) -> None:
+        """Write rows to a partition's storage, either appending or replacing its contents."""
+        # Validate before opening so a bad row cannot leave a truncated partition
+        self._check_fields(headers, rows)
+        if not append:
+            self._close_session_files(partition_path)
+        
+        if self.storage_layout == 'column':
+            columns = self._column_values(headers, rows)
+            os.makedirs(partition_path, exist_ok=True)
+            for column_idx, values in enumerate(columns):
+                column_path = os.path.join(partition_path, f'col_{column_idx}.jsonl')
+                with (self._open_for_append(column_path, encoding='utf-8') if append
+                      else open(column_path, 'w', encoding='utf-8')) as file:
+                    file.write(json.dumps(values) + '\n')
+            # Write the schema last so its mtime covers every column file
+            with open(os.path.join(partition_path, 'columns.json'), 'w', encoding='utf-8') as file:
+                json.dump(headers, file)
+            return
+        
+        with (self._open_for_append(partition_path, newline='', encoding='utf-8', buffering=1 << 20) if append
+              else open(partition_path, 'w', newline='', encoding='utf-8', buffering=1 << 20)) as file:
+            writer = csv.DictWriter(file, fieldnames=headers)
+            if not append:
+                writer.writeheader()
+            writer.writerows(rows)
+    
+    def _remove_stored_partition(self, partition_path: str) -> None:
+        """Remove a partition's storage if it exists."""
+        self._close_session_files(partition_path)
+        if self.storage_layout == 'column':
+            shutil.rmtree(partition_path, ignore_errors=True)
+        elif os.path.exists(partition_path):
+            os.remove(partition_path)
+    
+    @staticmethod
+    def _fast_scan_key_column(text: str, key_column: str) -> Optional[List[Optional[str]]]:
+        """
+        Extract one column from CSV text with str.split, or return None when the
+        text needs the full csv parser. Without any quote characters no field can
+        contain a delimiter or line break, so lines and commas are exact boundaries.
+        """
+        if '"' in text or text.count('\r') != text.count('\r\n'):
+            return None
+        
+        lines = text.replace('\r\n', '\n').split('\n')
+        headers = lines[0].split(',')
+        if key_column not in headers:
             return []
         
+        key_col_idx = headers.index(key_column)
+        values: List[Optional[str]] = []
+        for line in lines[1:]:
+            if line:
+                fields = line.split(',', key_col_idx + 1)
+                values.append(fields[key_col_idx] if key_col_idx < len(fields) else None)
+        return values
+    
+    def _read_key_column(self, partition_path: str, key_column: str) -> List[Optional[str]]:
+        """
+        Read only the values of one column from a partition file, in row order,
+        without building a dict per row.
+        """
+        if self.storage_layout == 'column':
+            try:
+                headers = self._read_stored_headers(partition_path)
+                if key_column not in headers:
+                    return []
+                return self._read_stored_column(partition_path, headers.index(key_column))
+            except (IOError, ValueError):
+                return []
+        
         try:
             with open(partition_path, 'r', newline='', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                return list(reader)
-        except (IOError, csv.Error):
+                text = file.read()
+        except IOError:
+            return []
+        
+        if self.use_fast_scan:
+            values = self._fast_scan_key_column(text, key_column)
+            if values is not None:
+                return values
+        
+        try:
+            reader = csv.reader(io.StringIO(text, newline=''))
+            headers = next(reader, [])
+            if key_column not in headers:
+                return []
+            
+            key_col_idx = headers.index(key_column)
+            # Skip blank lines the same way csv.DictReader does so positions line up
+            return [row[key_col_idx] if key_col_idx < len(row) else None for row in reader if row]
+        except csv.Error:
             return []
     
-    def _stream_partition_data(self, partition_path: str):
-        """Stream partition data row by row instead of loading all into memory."""
-        if not os.path.exists(partition_path):
-            return
+    def _get_column_index(self, partition_path: str, column: str) -> Dict[str, List[int]]:
+        """
+        Get the value -> row positions index of a column in a partition,
+        building it on first use or after the partition file changes.
+        """
+        mtime = self._partition_mtime(partition_path)
+        if mtime is None:
+            return {}
+        
+        partition_indexes = self._partition_cache['column_index'].setdefault(partition_path, {})
+        cached_index = partition_indexes.get(column)
+        if cached_index is not None and cached_index[0] == mtime:
+            return cached_index[1]
+        
+        # Build from cached rows when available, otherwise read just the column
+        cached_data = self._get_cached_rows(partition_path, mtime)
+        if cached_data is not None:
+            values = [row.get(column) for row in cached_data]
+        else:
+            values = self._read_key_column(partition_path, column)
+        
+        column_index: Dict[str, List[int]] = {}
+        for position, value in enumerate(values):
+            column_index.setdefault(value, []).append(position)
+        
+        partition_indexes[column] = (mtime, column_index)
+        return column_index
+    
+    def _cache_partition_rows(self, partition_path: str, data: List[Dict[str, Any]], mtime: int) -> None:
+        """Store a partition's rows in the LRU row cache, evicting the oldest entry when full."""
+        with self._row_cache_lock:
+            self._row_cache[partition_path] = data
+            self._row_cache.move_to_end(partition_path)
+            self._mtime_cache[partition_path] = mtime
+            
+            while len(self._row_cache) > self._row_cache_limit:
+                evicted_path, _ = self._row_cache.popitem(last=False)
+                self._mtime_cache.pop(evicted_path, None)
+    
+    def _get_cached_rows(self, partition_path: str, mtime: Optional[int]) -> Optional[List[Dict[str, Any]]]:
+        """Get a partition's cached rows if they are still current for the given mtime."""
+        cached_data = self._row_cache.get(partition_path)
+        if cached_data is not None and self._mtime_cache.get(partition_path) == mtime:
+            return cached_data
+        return None
+    
+    def _invalidate_partition_rows(self, partition_path: str) -> None:
+        """Drop cached rows and column indexes for a partition."""
+        with self._row_cache_lock:
+            self._row_cache.pop(partition_path, None)
+            self._mtime_cache.pop(partition_path, None)
+        self._partition_cache['column_index'].pop(partition_path, None)
+    
+    def _read_partition_data(self, partition_path: str) -> List[Dict[str, Any]]:
+        """
+        Read all data from a partition file.
+        Unchanged partitions are served from the row cache; the returned rows
+        are shared with the cache and must not be mutated.
+        """
+        mtime = self._partition_mtime(partition_path)
+        if mtime is None:
+            return []
+        
+        cached_data = self._get_cached_rows(partition_path, mtime)
+        if cached_data is not None:
+            with self._row_cache_lock:
+                if partition_path in self._row_cache:
+                    self._row_cache.move_to_end(partition_path)
+            return cached_data
         
         try:
-            with open(partition_path, 'r', newline='', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    yield row
-        except (IOError, csv.Error):
-            return
+            headers, data = self._read_stored_rows(partition_path)
+        except (IOError, csv.Error, ValueError):
+            return []
+        
+        if headers:
+            self._update_partition_cache(partition_path, headers=headers)
+        
+        self._cache_partition_rows(partition_path, data, mtime)
+        return data
+    
+    def _has_current_index(self, partition_path: str, column: str) -> bool:
+        """Check whether a partition has a column index matching its current contents."""
+        cached_index = self._partition_cache['column_index'].get(partition_path, {}).get(column)
+        return cached_index is not None and cached_index[0] == self._partition_mtime(partition_path)
+    
+    def _scan_partitions(self, partition_files: List[str], key_column: str,
+                         scan: Callable[[str], Any]) -> List[Any]:
+        """
+        Apply scan to each partition and return the results in partition order.
+        Partitions with a current key column index are scanned inline; the rest
+        need file reads, so they run on a thread pool where I/O releases the GIL.
+        scan must not modify partitions: workers only fill their own partition's
+        cache entries, and only the row cache is locked.
+        """
+        results: Dict[str, Any] = {}
+        unindexed_files = []
+        for partition_path in partition_files:
+            if self._has_current_index(partition_path, key_column):
+                results[partition_path] = scan(partition_path)
+            else:
+                unindexed_files.append(partition_path)
+        
+        if len(unindexed_files) > 1:
+            max_workers = min(len(unindexed_files), (os.cpu_count() or 1) * 2)
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                results.update(zip(unindexed_files, pool.map(scan, unindexed_files)))
+        else:
+            for partition_path in unindexed_files:
+                results[partition_path] = scan(partition_path)
+        
+        return [results[partition_path] for partition_path in partition_files]
+    
+    def _may_contain_keys(self, partition_path: str, keys: Set[str]) -> bool:
+        """
+        Check whether any key occurs in the raw bytes of a row-layout partition,
+        searching the memory-mapped file without copying or decoding it.
+        False is definitive; True may be a false positive.
+        """
+        # csv only rewrites values containing quotes, so other keys appear verbatim
+        if (self.storage_layout != 'row' or len(keys) > self._mmap_probe_max_keys
+                or any('"' in key for key in keys)):
+            return True
+        
+        try:
+            with open(partition_path, 'rb') as file, \
+                    mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                return any(mapped_file.find(key.encode('utf-8')) != -1 for key in keys)
+        except (OSError, ValueError):
+            # Missing or empty files cannot be mapped; let the regular path handle them
+            return True
+    
+    def _lookup_keys(self, partition_path: str, key_column: str, keys: Set[str]) -> List[Dict[str, Any]]:
+        """Find rows whose key column value is in keys using the partition's column index."""
+        mtime = self._partition_mtime(partition_path)
+        cached_index = self._partition_cache['column_index'].get(partition_path, {}).get(key_column)
+        if ((cached_index is None or cached_index[0] != mtime)
+                and self._get_cached_rows(partition_path, mtime) is None
+                and not self._may_contain_keys(partition_path, keys)):
+            # None of the keys occur anywhere in the file; skip parsing it
+            return []
+        
+        column_index = self._get_column_index(partition_path, key_column)
+        
+        positions = sorted(position for key in keys for position in column_index.get(key, ()))
+        if not positions:
+            # The index proves none of the keys are stored here; skip the rows
+            return []
+        
+        partition_data = self._read_partition_data(partition_path)
+        return [dict(partition_data[position]) for position in positions]
     
-    def _write_partition_data(self, partition_path: str, data: List[Dict[str, Any]]) -> None:
+    def _write_partition_data(self, partition_path: str, data: List[Dict[str, Any]],
+                              headers: Optional[List[str]] = None) -> None:
         """Write all data to a partition file and update cache."""
         if not data:
             # If no data, remove the file if it exists
-            if os.path.exists(partition_path):
-                os.remove(partition_path)
+            self._remove_stored_partition(partition_path)
             # Update cache to reflect file removal
             self._update_partition_cache(partition_path, exists=False, row_count_delta=-self._partition_cache['row_counts'].get(partition_path, 0))
-            # Clear headers cache for removed file
+            # Clear headers, row and column index caches for removed file
             self._partition_cache['headers'].pop(partition_path, None)
+            self._invalidate_partition_rows(partition_path)
             return
         
-        headers = list(data[0].keys()) if data else []
-        with open(partition_path, 'w', newline='', encoding='utf-8') as file:
-            writer = csv.DictWriter(file, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(data)
+        # Reuse the partition's known headers to keep its schema consistent
+        if headers is None:
+            headers = self._get_cached_headers(partition_path) or list(data[0].keys())
+        self._write_stored_rows(partition_path, headers, data, append=False)
         
-        # Update cache with new file info
+        # Update cache with new file info; rows missing columns added by an
+        # update are filled in with '' so the cache matches a fresh read
+        header_count = len(headers)
+        data = [row if len(row) == header_count else {column: row.get(column, '') for column in headers}
+                for row in data]
+        self._partition_cache['column_index'].pop(partition_path, None)
+        self._cache_partition_rows(partition_path, data, self._partition_mtime(partition_path))
         old_count = self._partition_cache['row_counts'].get(partition_path, 0)
         new_count = len(data)
         self._update_partition_cache(partition_path, headers=headers, exists=True, 
                                    row_count_delta=new_count - old_count)
     
-    def _append_to_partition(self, partition_path: str, data: Dict[str, Any]) -> None:
-        """Append a single row to a partition file."""
+    def _rewrite_stored_rows(self, partition_path: str, replacements: Dict[int, Optional[Dict[str, str]]],
+                             key_column: str) -> Tuple[List[str], int, Dict[str, List[int]]]:
+        """
+        Stream a row-layout partition file into a temporary file, replacing or
+        dropping (None) the rows at the given positions, then atomically swap it
+        in. Only replaced rows are turned into dicts. The key column index of
+        the rewritten file is built in the same pass.
+        
+        Returns:
+            Tuple[List[str], int, Dict[str, List[int]]]: The partition headers,
+            the number of rows kept and the key column index of the new file.
+        """
+        self._close_session_files(partition_path)
+        kept_rows = 0
+        key_index: Dict[str, List[int]] = {}
+        with open(partition_path, 'r', newline='', encoding='utf-8') as source, \
+                tempfile.NamedTemporaryFile('w', newline='', encoding='utf-8', dir=self.storage_dir,
+                                            suffix='.tmp', delete=False) as target:
+            try:
+                reader = csv.reader(source)
+                writer = csv.writer(target)
+                headers = next(reader, [])
+                writer.writerow(headers)
+                key_col_idx = headers.index(key_column) if key_column in headers else len(headers)
+                
+                # Skip blank lines the same way csv.DictReader does so positions line up
+                for position, row in enumerate(row for row in reader if row):
+                    if position in replacements:
+                        if replacements[position] is None:
+                            continue
+                        updated_row = {**dict(zip(headers, row)), **replacements[position]}
+                        row = [values[0] for values in self._column_values(headers, [updated_row])]
+                    writer.writerow(row)
+                    key_index.setdefault(row[key_col_idx] if key_col_idx < len(row) else None,
+                                         []).append(kept_rows)
+                    kept_rows += 1
+                
+                # NamedTemporaryFile creates the file as 0600; keep the partition's own mode
+                shutil.copymode(partition_path, target.name)
+            except BaseException:
+                target.close()
+                os.remove(target.name)
+                raise
+        
+        os.replace(target.name, partition_path)
+        return headers, kept_rows, key_index
+    
+    def _fits_row_cache(self) -> bool:
+        """Check whether every partition can stay in the row cache without evicting another."""
+        return len(self._known_partitions) <= self._row_cache_limit
+    
+    def _replace_partition_rows(self, partition_path: str, key_column: str,
+                                replacements: Dict[int, Optional[Dict[str, str]]]) -> None:
+        """
+        Replace (dict of updated values) or drop (None) rows at the given positions
+        of a partition, found through the key_column index. Partitions that can
+        stay in the row cache, and updates that add columns, are rewritten from
+        memory; otherwise row-layout partitions are edited by streaming the file,
+        which also rebuilds the key column index so the next lookup skips a read.
+        """
+        # Columns introduced by an update extend the partition's headers
+        headers = self._get_cached_headers(partition_path)
+        new_columns = [] if headers is None else list(dict.fromkeys(
+            column for values in replacements.values() if values
+            for column in values if column not in headers))
+        
+        if (self.storage_layout == 'row' and not new_columns and not self._fits_row_cache() and
+                self._get_cached_rows(partition_path, self._partition_mtime(partition_path)) is None):
+            headers, kept_rows, key_index = self._rewrite_stored_rows(partition_path, replacements, key_column)
+            if not kept_rows:
+                self._write_partition_data(partition_path, [])
+                return
+            
+            # Cached rows are reread on demand; the key index is current for the new file
+            self._invalidate_partition_rows(partition_path)
+            self._partition_cache['column_index'][partition_path] = {
+                key_column: (self._partition_mtime(partition_path), key_index)
+            }
+            old_count = self._partition_cache['row_counts'].get(partition_path, 0)
+            self._update_partition_cache(partition_path, headers=headers, exists=True,
+                                         row_count_delta=kept_rows - old_count)
+            return
+        
+        # Copy rather than mutate rows shared with the row cache
+        partition_data = []
+        for position, row in enumerate(self._read_partition_data(partition_path)):
+            if position not in replacements:
+                partition_data.append(row)
+            elif replacements[position] is not None:
+                partition_data.append({**row, **replacements[position]})
+        self._write_partition_data(partition_path, partition_data,
+                                   headers + new_columns if new_columns else None)
+    
+    def _check_append_rows(self, partition_path: str, rows: List[Dict[str, Any]]) -> None:
+        """
+        Check rows against the headers they will be written with, so a bad row
+        is rejected when it is added rather than when its buffer is flushed.
+        """
+        buffered_rows = self._write_buffers.get(partition_path) or rows
+        headers = self._get_cached_headers(partition_path) or list(buffered_rows[0].keys())
+        self._check_fields(headers, rows)
+    
+    def _append_to_partition(self, partition_path: str, rows: List[Dict[str, Any]]) -> None:
+        """Buffer rows for a partition, flushing once the buffer reaches the threshold."""
+        buffer = self._write_buffers[partition_path]
+        buffer.extend(rows)
+        if len(buffer) >= self._buffer_threshold:
+            self._flush_partition(partition_path)
+    
+    def _flush_partition(self, partition_path: str) -> None:
+        """Write a partition's buffered rows to its file with a single open/write."""
+        rows = self._write_buffers.get(partition_path)
+        if not rows:
+            self._write_buffers.pop(partition_path, None)
+            return
+        
+        # Cached rows and indexes are rebuilt on the next read of this partition
+        self._invalidate_partition_rows(partition_path)
+        
         file_exists = self._partition_exists_cached(partition_path)
         
         if not file_exists:
             # Create new partition file with headers
-            headers = list(data.keys())
-            with open(partition_path, 'w', newline='', encoding='utf-8') as file:
-                writer = csv.DictWriter(file, fieldnames=headers)
-                writer.writeheader()
-                writer.writerow(data)
+            headers = list(rows[0].keys())
+            self._write_stored_rows(partition_path, headers, rows, append=False)
             
             # Update cache with new file info
-            self._update_partition_cache(partition_path, headers=headers, exists=True, row_count_delta=1)
+            self._update_partition_cache(partition_path, headers=headers, exists=True, row_count_delta=len(rows))
         else:
             # Append to existing partition using cached headers
             headers = self._get_cached_headers(partition_path)
             if not headers:
                 # Fallback if cache miss - use data keys
-                headers = list(data.keys())
+                headers = list(rows[0].keys())
             
-            with open(partition_path, 'a', newline='', encoding='utf-8') as file:
-                writer = csv.DictWriter(file, fieldnames=headers)
-                writer.writerow(data)
+            self._write_stored_rows(partition_path, headers, rows, append=True)
             
             # Update cache with row count increment
-            self._update_partition_cache(partition_path, row_count_delta=1)
+            self._update_partition_cache(partition_path, row_count_delta=len(rows))
+        
+        # Drop the rows only once written, so a failed write can be retried
+        del self._write_buffers[partition_path]
+    
+    def flush(self) -> None:
+        """Write all buffered rows to their partition files."""
+        for partition_path in list(self._write_buffers):
+            self._flush_partition(partition_path)
+        
+        # Push rows written through open session handles to the files
+        for file in self._session_files.values():
+            file.flush()
+    
+    @contextlib.contextmanager
+    def ingest_session(self) -> Iterator['MyDataWarehouse']:
+        """
+        Keep partition files open for appending until the session ends, so that
+        bulk ingests interleaved across partitions do not reopen files on every
+        flush. Pending rows are flushed and the files closed on exit.
+        
+        Example:
+            with warehouse.ingest_session():
+                for batch in batches:
+                    warehouse.add_data_bulk(batch)
+        """
+        self._session_depth += 1
+        try:
+            yield self
+        finally:
+            self._session_depth -= 1
+            if not self._session_depth:
+                try:
+                    self.flush()
+                finally:
+                    for file in self._session_files.values():
+                        file.close()
+                    self._session_files.clear()
     
     def add_data(self, data: Dict[str, Any]) -> None:
         """
@@ -197,85 +740,93 @@ class MyDataWarehouse(DataWarehouse):
         Args:
             data (Dict[str, Any]): A dictionary representing a row of data.
         """
-        if not data or 'id' not in data:
-            return
+        self.add_data_bulk([data])
+
+    def add_data_bulk(self, rows: List[Dict[str, Any]]) -> None:
+        """
+        Add multiple rows of data, grouping them by partition into the
+        partition write buffers.
         
-        # Determine partition based on ID hash
-        partition_id = self._hash_to_partition(data['id'])
-        partition_path = self._get_partition_path(partition_id)
+        Args:
+            rows (List[Dict[str, Any]]): A list of dictionaries, each representing a row of data.
+        """
+        # Group rows by partition based on ID hash
+        batches: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for row in rows:
+            if not row or 'id' not in row:
+                continue
+            partition_id = self._hash_to_partition(row['id'])
+            batches[self._get_partition_path(partition_id)].append(row)
         
-        # Append data to the appropriate partition
-        self._append_to_partition(partition_path, data)
+        # Validate every batch before buffering any, so a bad row adds nothing
+        for partition_path, batch in batches.items():
+            self._check_append_rows(partition_path, batch)
+        
+        # Append each batch to its partition
+        for partition_path, batch in batches.items():
+            self._append_to_partition(partition_path, batch)
 
     def update_data(self, key_column: str, key_value: Any, updated_data: Dict[str, Any]) -> None:
         """
         Update the first row matching the key column/value across all partitions.
-        Uses streaming to find matches efficiently before loading partition for update.
+        Matching rows are located through the partition column indexes.
         
         Args:
             key_column (str): The column to match for the update.
             key_value (Any): The value to match in the key column.
             updated_data (Dict[str, Any]): A dictionary with updated column values.
         """
-        partition_files = self._get_all_partition_files()
+        self.flush()
         str_key_value = str(key_value)
         
+        # Optimize for ID-based operations - only the hashed partition can match
+        if key_column == 'id':
+            partition_files = [self._get_partition_path(self._hash_to_partition(str_key_value))]
+        else:
+            partition_files = self._get_all_partition_files()
+        
         for partition_path in partition_files:
-            # First, use streaming to check if the partition contains matching data
-            found_match = False
-            for row in self._stream_partition_data(partition_path):
-                if row.get(key_column) == str_key_value:
-                    found_match = True
-                    break
+            positions = self._get_column_index(partition_path, key_column).get(str_key_value)
+            if not positions:
+                continue
             
-            # Only load the full partition if we found a match
-            if found_match:
-                partition_data = self._read_partition_data(partition_path)
-                updated = False
-                
-                for row in partition_data:
-                    if row.get(key_column) == str_key_value:
-                        row.update(updated_data)
-                        updated = True
-                        break  # Update only the first matching row
-                
-                if updated:
-                    self._write_partition_data(partition_path, partition_data)
-                    return  # Stop after first update
+            # Update only the first matching row, storing values as the strings
+            # a fresh CSV read would return
+            self._replace_partition_rows(partition_path, key_column, {positions[0]: {
+                column: '' if value is None else str(value) for column, value in updated_data.items()
+            }})
+            return  # Stop after first update
 
     def delete_data(self, key_column: str, key_value: Any) -> None:
         """
         Delete all rows matching the key column/value across all partitions.
-        Uses streaming to find matches efficiently before loading partition for deletion.
+        Matching rows are located through the partition column indexes, and only
+        partitions containing matches are rewritten.
         
         Args:
             key_column (str): The column to match for the deletion.
             key_value (Any): The value to match in the key column.
         """
-        partition_files = self._get_all_partition_files()
+        self.flush()
         str_key_value = str(key_value)
         
+        # Optimize for ID-based operations - only the hashed partition can match
+        if key_column == 'id':
+            partition_files = [self._get_partition_path(self._hash_to_partition(str_key_value))]
+        else:
+            partition_files = self._get_all_partition_files()
+        
+        # Rewrites change shared partition state, so partitions are handled serially
         for partition_path in partition_files:
-            # First, use streaming to check if the partition contains matching data
-            found_match = False
-            for row in self._stream_partition_data(partition_path):
-                if row.get(key_column) == str_key_value:
-                    found_match = True
-                    break
-            
-            # Only load the full partition if we found a match
-            if found_match:
-                partition_data = self._read_partition_data(partition_path)
-                filtered_data = [row for row in partition_data if row.get(key_column) != str_key_value]
-                
-                # Only rewrite if data was actually deleted
-                if len(filtered_data) != len(partition_data):
-                    self._write_partition_data(partition_path, filtered_data)
+            positions = self._get_column_index(partition_path, key_column).get(str_key_value)
+            if positions:  # Otherwise nothing to delete, so skip the rewrite
+                self._replace_partition_rows(partition_path, key_column, dict.fromkeys(positions))
 
     def query_data(self, key_column: str, keys: List[Any]) -> List[Dict[str, Any]]:
         """
         Query data from partitions for rows matching the key column values.
-        Uses partition-aware querying for 'id' column and memory-efficient streaming.
+        Uses partition-aware querying for the 'id' column and per-partition
+        column indexes so that matching rows are found without scanning.
         
         Args:
             key_column (str): The column to match for the query.
@@ -287,29 +838,30 @@ class MyDataWarehouse(DataWarehouse):
         if not keys:
             return []
         
+        self.flush()
         results = []
-        str_keys = set(str(key) for key in keys)  # Use set for faster lookups
+        str_keys = frozenset(str(key) for key in keys)  # Use a set for faster lookups
         
         # Optimize for ID-based queries - search only relevant partitions
         if key_column == 'id':
-            target_partitions = set()
+            keys_by_partition: Dict[str, Set[str]] = defaultdict(set)
             for key in str_keys:
                 partition_id = self._hash_to_partition(key)
                 partition_path = self._get_partition_path(partition_id)
-                target_partitions.add(partition_path)
+                # Keys hashing to a partition that was never created cannot match
+                if self._partition_exists_cached(partition_path):
+                    keys_by_partition[partition_path].add(key)
             
-            for partition_path in target_partitions:
-                # Use streaming to avoid loading entire partition into memory
-                for row in self._stream_partition_data(partition_path):
-                    if row.get(key_column) in str_keys:
-                        results.append(row)
+            # No early exit once every key has a match: the index already jumps
+            # straight to matching positions, and ids are not enforced unique
+            for partition_path, partition_keys in keys_by_partition.items():
+                results.extend(self._lookup_keys(partition_path, key_column, partition_keys))
         else:
-            # Fall back to searching all partitions for non-ID queries with streaming
+            # Fall back to searching all partitions for non-ID queries
             partition_files = self._get_all_partition_files()
-            for partition_path in partition_files:
-                # Use streaming to avoid loading entire partition into memory
-                for row in self._stream_partition_data(partition_path):
-                    if row.get(key_column) in str_keys:
-                        results.append(row)
+            for partition_results in self._scan_partitions(
+                    partition_files, key_column,
+                    lambda partition_path: self._lookup_keys(partition_path, key_column, str_keys)):
+                results.extend(partition_results)
         
         return results